@@ -1,4 +1,3 @@
-import random
 import numpy as np
 
 def generate_frequency_dict(N, n, distribution="uniform", alpha=1.0):
@@ -17,22 +16,18 @@ def generate_frequency_dict(N, n, distribution="uniform", alpha=1.0):
     """
     if distribution == "uniform":
         # Uniform distribution: each value has an equal probability
-        stream = [random.randint(1, n) for _ in range(N)]
+        stream = np.random.randint(1, n + 1, size=N, dtype=np.int64)
     elif distribution == "zipf":
         # Zipf distribution: some values appear much more frequently
         stream = np.random.zipf(alpha, N)
         # Map values to the range 1 to n
-        stream = [x % n + 1 for x in stream]
+        stream = stream % n + 1
     else:
         raise ValueError("Invalid distribution. Choose 'uniform' or 'zipf'.")
     
     # Generate frequency dictionary
-    frequency_dict = {}
-    for value in stream:
-        if value in frequency_dict:
-            frequency_dict[value] += 1
-        else:
-            frequency_dict[value] = 1
+    keys, counts = np.unique(stream, return_counts=True)
+    frequency_dict = dict(zip(keys.tolist(), counts.tolist()))
     
     return frequency_dict
 
@@ -41,19 +36,23 @@ def dict_to_random_list(frequency_dict):
     Convert a frequency dictionary into a randomized list.
     
     Args:
-        frequency_dict (dict): A dictionary where keys are distinct values
-                               and values are their frequencies.
+        frequency_dict (dict or tuple): A dictionary where keys are distinct values
+                               and values are their frequencies, or a
+                               (keys, counts) pair of arrays.
                                
     Returns:
-        list: A randomized list where each value appears according to its frequency.
+        np.ndarray: A randomized array where each value appears according to its frequency.
     """
-    # Create a list with occurrences of each key
-    result_list = []
-    for value, frequency in frequency_dict.items():
-        result_list.extend([value] * frequency)
+    if isinstance(frequency_dict, dict):
+        keys = np.fromiter(frequency_dict.keys(), dtype=np.int64, count=len(frequency_dict))
+        counts = np.fromiter(frequency_dict.values(), dtype=np.int64, count=len(frequency_dict))
+    else:
+        keys, counts = frequency_dict
+    # Create an array with occurrences of each key
+    result_list = np.repeat(keys, counts)
     
-    # Shuffle the list
-    random.shuffle(result_list)
+    # Shuffle the array
+    np.random.shuffle(result_list)
     
     return result_list
 
@@ -69,7 +68,7 @@ def generate_list(N, n, distribution="uniform", alpha=1.0):
         
     Returns:
         tuple: A tuple containing:
-            - list: Randomized list of elements.
+            - np.ndarray: Randomized array of elements.
             - int: True cardinality (number of distinct keys in the frequency dictionary).
             - dict: Frequency dictionary with distinct values and their occurrences.
     """
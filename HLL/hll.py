@@ -1,15 +1,20 @@
 from __future__ import annotations
-from randomhash import RandomHashFamily
+import math
 import numpy as np
+import xxhash
 import warnings
 import struct
 from typing import Callable, Optional
+from .hll_kernel import hll_update
 
 # Get the number of bits starting from the first non-zero bit to the right
 _bit_length = lambda bits: bits.bit_length()
 if not hasattr(int, "bit_length"):
     _bit_length = lambda bits: len(bin(bits)) - 2 if bits > 0 else 0
 
+# Default hash function: a single C call from bytes to a 32-bit integer
+_default_hash_bytes = xxhash.xxh32_intdigest
+
 class HyperLogLog(object):
     """
     Args:
@@ -18,14 +23,22 @@ class HyperLogLog(object):
         hashfunc (Callable): The hash function used by this MinHash.
             It takes the input passed to the `update` method and
             returns an integer that can be encoded with 32 bits.
-            The default hash function is based on SHA1 from hashlib_.
+            The default hash function is xxHash32 from xxhash.
+        reg (Optional[numpy.array]): The internal state.
+            This argument is for initializing the HyperLogLog from
+            existing registers, e.g. the result of `union`.
     """
 
-    __slots__ = ("p", "m", "reg", "alpha", "max_rank", "hashfunc")
+    __slots__ = ("p", "m", "reg", "alpha", "max_rank", "hashfunc", "_nonzero",
+                 "_alpha_mm", "_small_thr", "_large_thr")
 
     # The range of the hash values used for HyperLogLog
     _hash_range_bit = 32
     _hash_range_byte = 4
+    _two32 = 1 << 32
+    # 2^-i for every possible register value, so count() is a lookup
+    # instead of a power over the m registers
+    _POW2_NEG = (2.0 ** -np.arange(64)).astype(np.float64)
 
     def _get_alpha(self, p):
         if not (4 <= p <= 16):
@@ -42,15 +55,27 @@ class HyperLogLog(object):
         self,
         p: int = 8,
         hashfunc: Callable = None,
+        reg: Optional[np.ndarray] = None,
     ):
-        self.p = p
-        self.m = 1 << p
-        self.reg = np.zeros((self.m,), dtype=np.int8)
+        if reg is None:
+            self.p = p
+            self.m = 1 << p
+            # uint8 registers match the serialized format and let np.maximum
+            # work on packed, contiguous bytes
+            self.reg = np.zeros((self.m,), dtype=np.uint8, order="C")
+        else:
+            # Check if the register has the correct size
+            self.p = int(np.log2(len(reg)))
+            self.m = 1 << self.p
+            if len(reg) != self.m:
+                raise ValueError("The length of reg must be a power of 2")
+            self.reg = np.ascontiguousarray(reg, dtype=np.uint8)
+        # Number of non-zero registers, kept up to date by the updates
+        self._nonzero = int(np.count_nonzero(self.reg))
 
         # Check the hash function.
         if hashfunc is None:
-            random_hash_family = RandomHashFamily(count=1)  # Une seule fonction de hachage
-            self.hashfunc = lambda x: random_hash_family.hashes(str(x))[0]
+            self.hashfunc = _default_hash_bytes
         elif not callable(hashfunc):
             raise ValueError("The hashfunc must be a callable.")
         else:
@@ -58,11 +83,80 @@ class HyperLogLog(object):
         # Common settings
         self.alpha = self._get_alpha(self.p)
         self.max_rank = self._hash_range_bit - self.p
+        # Constants of count(), computed once instead of on every estimate
+        self._alpha_mm = self.alpha * (self.m * self.m)
+        self._small_thr = 2.5 * self.m
+        self._large_thr = self._two32 / 30.0
 
     def add_elements_to_hll(self, stream_list):
-        for d in stream_list:
-            self.update(str(d).encode('utf8'))
-            
+        self.add_batch(stream_list)
+
+    def hash_stream(self, stream, distinct=False, raw_int_keys=False):
+        """
+        Hash a whole stream of values the way `add_batch` does.
+
+        Args:
+            stream: An iterable of values. Bytes are hashed as they are,
+                any other value through its str() in UTF-8, like `update`.
+            distinct (bool): Only hash each distinct encoded value once.
+            raw_int_keys (bool): Key an integer NumPy array by the 8
+                little-endian bytes of each value instead, which avoids
+                building a str per element. These hashes differ from
+                `update` on the same values, so only use them in sketches
+                that are never fed or merged otherwise.
+
+        Returns:
+            np.ndarray: The uint32 hash value of every element, or of every
+                distinct element if `distinct` is set.
+        """
+        if isinstance(stream, np.ndarray) and np.issubdtype(stream.dtype, np.integer):
+            if distinct:
+                stream = np.unique(stream)
+                distinct = False
+            if raw_int_keys:
+                raw = stream.astype("<u8", copy=False).tobytes()
+                encoded = [raw[i:i + 8] for i in range(0, len(raw), 8)]
+            else:
+                encoded = [str(d).encode('utf8') for d in stream.tolist()]
+        else:
+            encoded = [d if isinstance(d, bytes) else str(d).encode('utf8') for d in stream]
+        if distinct:
+            encoded = list(dict.fromkeys(encoded))
+        hashfunc = self.hashfunc
+        return np.fromiter((hashfunc(b) for b in encoded), dtype=np.uint32, count=len(encoded))
+
+    def add_batch(self, stream, precomputed_hashes=None):
+        """
+        Update the HyperLogLog with a whole stream of values at once.
+        Duplicates cannot change the registers, so every distinct value is
+        encoded and hashed once, then the register indexes
+        and ranks are computed with NumPy array operations and merged into
+        the registers with a single scatter-max, or with the compiled
+        kernel from `hll_kernel` when Numba is installed.
+
+        Args:
+            stream: An iterable of values, hashed as in `hash_stream`.
+            precomputed_hashes: The result of `hash_stream` for this stream.
+                When given, `stream` is not hashed again.
+        """
+        if precomputed_hashes is None:
+            hv = self.hash_stream(stream, distinct=True)
+        else:
+            hv = np.asarray(precomputed_hashes, dtype=np.uint32)
+        if not hv.size:
+            return
+        if hll_update is not None:
+            self._nonzero += hll_update(hv, self.reg, self.p, self.max_rank)
+            return
+        # Get the index of the registers using the first p bits of the hashes
+        reg_index = hv & np.uint32(self.m - 1)
+        # Get the rest of the hashes
+        bits = hv >> np.uint32(self.p)
+        # Every rank is at least 1, so each distinct empty register hit becomes non-zero
+        self._nonzero += np.unique(reg_index[self.reg[reg_index] == 0]).size
+        # Update the registers
+        np.maximum.at(self.reg, reg_index, self._vec_rank(bits))
+
     def update(self, b):
         """
         Update the HyperLogLog with a new data value in bytes.
@@ -74,18 +168,44 @@ class HyperLogLog(object):
         """
         # Handle integers by converting them to strings
         if isinstance(b, int) or isinstance(b, np.integer):
-            b = str(b).encode('utf8')
+            self.update_int(b)
         elif isinstance(b, str):
-            b = b.encode('utf8')
+            self.update_bytes(b.encode('utf8'))
+        else:
+            self.update_bytes(b)
+
+    def update_int(self, i):
+        """
+        Update the HyperLogLog with an integer, hashed through its
+        decimal representation like `update` does.
+        """
+        self.update_bytes(str(i).encode('utf8'))
 
+    def update_bytes(self, b):
+        """
+        Update the HyperLogLog with a value that is already in bytes,
+        without any type dispatching.
+        """
         # Digest the hash object to get the hash value
         hv = int(self.hashfunc(b))  
         # Get the index of the register using the first p bits of the hash
         reg_index = hv & (self.m - 1)
         # Get the rest of the hash
         bits = hv >> self.p
-        # Update the register
-        self.reg[reg_index] = max(self.reg[reg_index], self._get_rank(bits))
+        rank = self._get_rank(bits)
+        # Update the register, reading it once and writing only if it grows
+        current = self.reg[reg_index]
+        if rank > current:
+            if current == 0:
+                self._nonzero += 1
+            self.reg[reg_index] = rank
+
+    def clear(self):
+        """
+        Reset the HyperLogLog to empty, reusing the register array.
+        """
+        self.reg.fill(0)
+        self._nonzero = 0
 
     def count(self):
         """
@@ -94,10 +214,13 @@ class HyperLogLog(object):
         Returns:
             float: The estimated cardinality.
         """
-        # Use HyperLogLog estimation function
-        e = self.alpha * float(self.m**2) / np.sum(2.0 ** (-self.reg))
+        # Use HyperLogLog estimation function. Registers only take a few
+        # distinct values, so the harmonic sum is taken over their histogram
+        # rather than over the m registers one by one.
+        hist = np.bincount(self.reg)
+        e = self._alpha_mm / float(hist @ HyperLogLog._POW2_NEG[: hist.size])
         # Small range correction
-        small_range_threshold = (5.0 / 2.0) * self.m
+        small_range_threshold = self._small_thr
         if abs(e - small_range_threshold) / small_range_threshold < 0.15:
             warnings.warn(
                 (
@@ -106,10 +229,10 @@ class HyperLogLog(object):
                 )
             )
         if e <= small_range_threshold:
-            num_zero = self.m - np.count_nonzero(self.reg)
+            num_zero = self.m - self._nonzero
             return self._linearcounting(num_zero)
         # Normal range, no correction
-        if e <= (1.0 / 30.0) * (1 << 32):
+        if e <= self._large_thr:
             return e
         # Large range correction
         return self._largerange_correction(e)
@@ -124,8 +247,84 @@ class HyperLogLog(object):
             )
         return rank
 
+    def _vec_rank(self, bits):
+        """
+        Vectorized version of `_get_rank` for a uint32 array of bits.
+        The bit length is read from the IEEE-754 exponent of bits + 0.5:
+        float64 represents every uint32 exactly and adding 0.5 never
+        crosses a power of two, so a zero maps to the exponent of 0.5
+        which gives a bit length of 0 without any special casing.
+        """
+        f = bits.astype(np.float64) + 0.5
+        bit_length = (f.view(np.uint64) >> np.uint64(52)).astype(np.int64) - 1022
+        rank = self.max_rank - bit_length + 1
+        if rank.size and rank.min() <= 0:
+            raise ValueError(
+                "Hash value overflow, maximum size is %d\
+                    bits"
+                % self.max_rank
+            )
+        return rank.astype(np.uint8)
+
+    def bytesize(self):
+        """
+        Get the size of the HyperLogLog in bytes when serialized.
+
+        Returns:
+            int: One byte for p followed by one byte per register.
+        """
+        return 1 + self.m
+
+    def serialize(self, buf):
+        """
+        Serialize the HyperLogLog into a writable buffer, such as a
+        bytearray of at least `bytesize()` bytes.
+        """
+        if len(buf) < self.bytesize():
+            raise ValueError(
+                "The buffer does not have enough space "
+                "for holding this HyperLogLog."
+            )
+        buf[0] = self.p
+        memoryview(buf)[1 : 1 + self.m] = self.reg.tobytes()
+
+    @classmethod
+    def deserialize(cls, buf, hashfunc: Callable = None):
+        """
+        Rebuild a HyperLogLog from a buffer written by `serialize`.
+        The hash function is not serialized and must be given again.
+        """
+        p = buf[0]
+        reg = np.frombuffer(buf, dtype=np.uint8, count=1 << p, offset=1).copy()
+        return cls(reg=reg, hashfunc=hashfunc)
+
+    @classmethod
+    def union(cls, *hlls):
+        """
+        Create a new HyperLogLog that is the union of the given ones.
+        They must all have the same precision.
+
+        Returns:
+            HyperLogLog: The union, using the hash function of the first one.
+        """
+        if len(hlls) < 1:
+            raise ValueError("Cannot create union of zero HyperLogLog")
+        it = iter(hlls)
+        first = next(it)
+        acc = first.reg.copy()
+        for h in it:
+            if h.p != first.p:
+                raise ValueError(
+                    "Cannot union HyperLogLog with different precisions"
+                )
+            np.maximum(acc, h.reg, out=acc)
+        return cls(reg=acc, hashfunc=first.hashfunc)
+
     def _linearcounting(self, num_zero):
-        return self.m * np.log(self.m / float(num_zero))
+        return self.m * math.log(self.m / num_zero)
 
     def _largerange_correction(self, e):
-        return -(1 << 32) * np.log(1.0 - e / (1 << 32))
\ No newline at end of file
+        # Beyond 2^32 the correction diverges, saturated registers give inf
+        if e >= self._two32:
+            return float('inf')
+        return -self._two32 * math.log1p(-e / self._two32)
\ No newline at end of file
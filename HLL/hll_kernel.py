@@ -0,0 +1,41 @@
+import math
+import numpy as np
+
+# Numba is optional: without it HyperLogLog keeps its pure NumPy batch path
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+
+def _hll_update(hv, reg, p, max_rank):
+    """
+    Merge a uint32 array of hash values into the registers in a single pass:
+    index from the first p bits, rank from the bit length of the rest, and
+    keep the maximum per register. Returns the number of registers that
+    went from zero to non-zero.
+
+    The loop is kept serial: with a parallel loop two hashes hitting the
+    same register could race and keep the smaller rank.
+    """
+    mask = np.uint32(reg.size - 1)
+    shift = np.uint32(p)
+    filled = 0
+    for i in range(hv.size):
+        h = hv[i]
+        idx = h & mask
+        bits = h >> shift
+        # frexp(bits + 0.5) gives the bit length, 0 for bits == 0
+        rank = max_rank - math.frexp(bits + 0.5)[1] + 1
+        if rank > reg[idx]:
+            if reg[idx] == 0:
+                filled += 1
+            reg[idx] = rank
+    return filled
+
+
+if HAVE_NUMBA:
+    hll_update = njit(cache=True, nogil=True)(_hll_update)
+else:
+    hll_update = None
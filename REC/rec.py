@@ -1,4 +1,5 @@
-from collections import OrderedDict
+import heapq
+import numpy as np
 from typing import Callable, List, Dict
 
 class Element:
@@ -12,6 +13,14 @@ class Element:
     def __repr__(self):
         return f"Element(value='{self.value}', count={self.count})"
 
+def first_occurrences(hashes):
+    """
+    Keep the first occurrence of every hash value, in stream order.
+    """
+    hashes = np.asarray(hashes, dtype=np.float64)
+    _, first = np.unique(hashes, return_index=True)
+    return hashes[np.sort(first)]
+
 class Recordinality:
     def __init__(
         self, k: int, 
@@ -19,14 +28,72 @@ class Recordinality:
         ):
         self.k = k
         self.hashfunc = hashfunc
-        self.k_map = OrderedDict()
+        # Hash value -> Element for the k largest hashes seen so far, and a
+        # min-heap over the same hashes so the smallest is found in O(log k)
+        self.k_map: Dict[float, Element] = {}
+        self._heap: List[float] = []
         self.modifications = 0
         self.cached_min = float('-inf')
     
+    def clear(self):
+        """
+        Reset the Recordinality to empty so it can be reused for another run.
+        """
+        self.k_map.clear()
+        self._heap.clear()
+        self.modifications = 0
+        self.cached_min = float('-inf')
+
     def run_rec(self, stream_list):
         for element in stream_list:
             self.update(element)
 
+    def estimate_from_hashes(self, hashes, block_size: int = 4096, distinct: bool = False):
+        """
+        Run Recordinality over a stream given only by the hashes of its
+        elements, in stream order, and return the estimate. Gives the same
+        count of records as `run_rec` on the elements, i.e. as calling
+        `_insert_hashed` with each hash in order, without a Python step per
+        element: only first occurrences can be records, and within a block
+        any hash not above the smallest kept hash at the start of the block
+        is rejected by NumPy before the heap is touched.
+        Only `modifications`, the heap and `cached_min` are set: the elements
+        and their counts are unknown, so k_map is left empty. Call `clear()`
+        before feeding elements with `update` again.
+
+        Args:
+            hashes: The hash of each element of the stream, in order.
+            block_size (int): Number of hashes filtered at once.
+            distinct (bool): The hashes are already the first occurrences
+                only, e.g. from `first_occurrences`, so they are not
+                deduplicated again.
+
+        Returns:
+            int: The estimated cardinality.
+        """
+        self.clear()
+        if distinct:
+            hashes = np.asarray(hashes, dtype=np.float64)
+        else:
+            hashes = first_occurrences(hashes)
+
+        # Reuse the heap emptied by clear() instead of allocating a new one
+        heap = self._heap
+        heap.extend(hashes[:self.k].tolist())
+        heapq.heapify(heap)
+        modifications = len(heap)
+        for start in range(self.k, hashes.size, block_size):
+            block = hashes[start:start + block_size]
+            for hashed_value in block[block > heap[0]].tolist():
+                if hashed_value > heap[0]:
+                    heapq.heapreplace(heap, hashed_value)
+                    modifications += 1
+
+        if heap:
+            self.cached_min = heap[0]
+        self.modifications = modifications
+        return self.estimate_cardinality()
+
     def update(self, element: str):
         inserted = self._insert_if_fits(element)
         if inserted:
@@ -38,24 +105,28 @@ class Recordinality:
         return int(estimate)
 
     def _insert_if_fits(self, element: str):
-        hashed_value = self.hashfunc(element)
+        return self._insert_hashed(self.hashfunc(element), element)
 
+    def _insert_hashed(self, hashed_value: float, element: str):
         if hashed_value < self.cached_min and len(self.k_map) >= self.k:
             return False
 
-        if hashed_value in self.k_map:
-            self.k_map[hashed_value].increment()
+        # A single probe of k_map both tests membership and fetches the entry
+        kept = self.k_map.get(hashed_value)
+        if kept is not None:
+            kept.increment()
             return False
         else:
             if len(self.k_map) < self.k:
+                heapq.heappush(self._heap, hashed_value)
                 self.k_map[hashed_value] = Element(element)
-                self.cached_min = min(self.k_map.keys())
+                self.cached_min = self._heap[0]
             else:
-                lowest_key = min(self.k_map.keys())
-                if hashed_value > lowest_key:
+                if hashed_value > self._heap[0]:
+                    lowest_key = heapq.heapreplace(self._heap, hashed_value)
                     del self.k_map[lowest_key]
                     self.k_map[hashed_value] = Element(element)
-                    self.cached_min = min(self.k_map.keys())
+                    self.cached_min = self._heap[0]
                 else:
                     return False
             return True
@@ -2,6 +2,7 @@
 import matplotlib.pyplot as plt
 from randomhash import RandomHashFamily
 
+# Built once outside the lambda, so every element goes through the same hash
 random_hash_family = RandomHashFamily(count=1)
 hashfunc = lambda x: random_hash_family.hashes(str(x))[0] / (2**32 - 1)
 
@@ -9,12 +9,38 @@ def read_txt_as_list(file_path):
         list: A list of words from the text file.
     """
     try:
-        # Open the file and read its content
+        # Read the file line by line and split each line into words, so the
+        # whole content never sits in memory next to the list of words
+        words = []
         with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
+            for line in file:
+                words.extend(line.split())
         
-        # Split the content into words
-        words = content.split()
+        return words
+
+    except FileNotFoundError:
+        print(f"Error: The file at {file_path} was not found.")
+        return []
+    except Exception as e:
+        print(f"An error occurred while reading the file: {e}")
+        return []
+
+def read_txt_as_bytes_list(file_path):
+    """
+    Read a local .txt file and return its words as bytes, as they are
+    in the file, so they can be hashed without any encoding step.
+
+    Args:
+        file_path (str): The path to the .txt file on the local computer.
+
+    Returns:
+        list: A list of words from the text file, as bytes.
+    """
+    try:
+        words = []
+        with open(file_path, 'rb') as file:
+            for line in file:
+                words.extend(line.split())
         
         return words
 
@@ -40,11 +66,12 @@ def get_cardinality_and_dict_from_dat(file_path):
     try:
         # Read the file and construct the dictionary
         word_dict = {}
-        with open(file_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                # Split each line into key-value pairs
-                key, value = line.strip().split(": ")
-                word_dict[key] = int(value)
+        with open(file_path, 'rb') as file:
+            data = file.read()
+        for line in data.splitlines():
+            # Split each line into key-value pairs
+            key, _, value = line.partition(b": ")
+            word_dict[key.decode('utf-8')] = int(value)
         
         # Calculate the cardinality (number of unique keys)
         cardinality = len(word_dict)
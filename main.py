@@ -1,14 +1,20 @@
 import csv
+import contextlib
+import itertools
+import math
 import time
 import random
 import hashlib
 import xxhash
 import os
+import pickle
+import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor
 from randomhash import RandomHashFamily
-from REC.rec import Recordinality
+from REC.rec import Recordinality, first_occurrences
 from HLL.hll import HyperLogLog 
 from Generator.generator import generate_list
-from Tools.file_reader import read_txt_as_list, get_cardinality_and_dict_from_dat
+from Tools.file_reader import read_txt_as_bytes_list, get_cardinality_and_dict_from_dat
 
 configurations = [
     {"N": 1000, "n": 100, "alpha": 1.2},
@@ -31,85 +37,280 @@ def get_book_pairs(directory):
     Returns:
         dict: Dictionary with book names as keys and paths to .txt and .dat files as values.
     """
-    files = os.listdir(directory)
     book_pairs = {}
     
-    # Group files by name without extensions
-    for file in files:
-        name, ext = os.path.splitext(file)
-        if ext == ".txt" or ext == ".dat":
-            if name not in book_pairs:
-                book_pairs[name] = {}
-            book_pairs[name][ext[1:]] = os.path.join(directory, file)
+    # Group files by name without extensions, DirEntry already carries the full path
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            name, ext = os.path.splitext(entry.name)
+            if ext == ".txt" or ext == ".dat":
+                book_pairs.setdefault(name, {})[ext[1:]] = entry.path
     
     # Filter out incomplete pairs
     return {name: paths for name, paths in book_pairs.items() if "txt" in paths and "dat" in paths}
 
-def sha256_hash_int(element):
-    return int(hashlib.sha256(str(element).encode()).hexdigest(), 16) & 0xFFFFFFFF 
+# RandomHashFamily draws a random hash function, and the experiments average
+# over independent draws: _run_configuration draws a new family at the start of
+# every run with _draw_random_hash_family(). A new family per call would be a
+# different hash for every element, so the wrappers below use the current one.
+random_hash_family = None
 
-def xxhash32_int(element):
-    return xxhash.xxh32(str(element).encode()).intdigest() 
+def _draw_random_hash_family(seed):
+    """
+    Draw the hash function used by random_hash_int and random_hash.
+    The seed is the run index, so every configuration sees the same draws,
+    whatever the process it runs in.
+    """
+    global random_hash_family
+    random_hash_family = RandomHashFamily(count=1, seed=seed)
+
+_draw_random_hash_family(0)
+
+# Multiplying by these is cheaper than dividing by a Python int on every call
+_INV_U32 = 1.0 / ((1 << 32) - 1)
+_INV_U64 = 1.0 / (1 << 64)
+
+# The hash functions take elements already encoded to bytes, see encode_stream()
+def sha256_hash_int(b):
+    return int.from_bytes(hashlib.sha256(b).digest()[:4], 'big')
+
+def xxhash32_int(b):
+    return xxhash.xxh32_intdigest(b)
+
+def xxh3_64_int(b):
+    # HyperLogLog works on 32-bit hashes, xxh3 is well mixed so the low bits are enough
+    return xxhash.xxh3_64_intdigest(b) & 0xFFFFFFFF
+
+def python_hash_int(b):
+    return hash(b) & 0xFFFFFFFF 
+
+def random_hash_int(b):
+    # RandomHashFamily only accepts str keys. latin-1 maps every byte to one
+    # character, so this is lossless and gives back the word for ASCII tokens.
+    return random_hash_family.hashes(b.decode('latin-1'))[0]
+
+def sha256_hash(b):
+    return int.from_bytes(hashlib.sha256(b).digest()[:4], 'big') * _INV_U32
+
+def xxhash32(b):
+    return xxhash.xxh32_intdigest(b) * _INV_U32
+
+def xxh3_64(b):
+    return xxhash.xxh3_64_intdigest(b) * _INV_U64
+
+def python_hash(b):
+    return (hash(b) & 0xFFFFFFFF) * _INV_U32
+
+def random_hash(b):
+    return random_hash_int(b) * _INV_U32
+
+# Hash functions drawn again for every run, their hashes are never reused across runs
+_REDRAWN_PER_RUN = (random_hash_int, random_hash)
+
+def encode_stream(data_stream):
+    """
+    Encode every element of a stream to bytes once, so the hash functions
+    never have to call str() and encode() themselves.
+    Args:
+        data_stream (list): The list of data to encode.
+    Returns:
+        list: The elements as bytes, bytes elements are kept as they are.
+    """
+    return [e if isinstance(e, bytes) else str(e).encode('utf8') for e in data_stream]
+
+# Distinct stream of the current test, set in every worker by _init_worker()
+_distinct_stream = None
+
+def _warm_up():
+    # Load the compiled HyperLogLog kernel, if any, before anything is timed
+    HyperLogLog(p=4).add_batch(None, precomputed_hashes=np.zeros(1, dtype=np.uint32))
+
+def _picklable(*objs):
+    # Only picklable callables can be sent to a worker process, not lambdas or closures
+    try:
+        pickle.dumps(objs)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+def _init_worker(distinct_stream):
+    global _distinct_stream
+    _distinct_stream = distinct_stream
+    _warm_up()
+
+def _hash_stream(algorithm, hash_func):
+    # Hash every element of the distinct stream of the current test. Two
+    # elements can still share a hash, REC only keeps the first of them.
+    if algorithm == "REC":
+        return first_occurrences(np.fromiter(
+            (hash_func(b) for b in _distinct_stream), dtype=np.float64, count=len(_distinct_stream)
+        ))
+    elif algorithm == "HLL":
+        # Generated integer streams are keyed by their raw bytes, they are never
+        # mixed with other sketches
+        return HyperLogLog(hashfunc=hash_func).hash_stream(_distinct_stream, raw_int_keys=True)
+
+def _hash_distinct(algorithm, hash_func):
+    """
+    Hash the distinct stream of the current test once.
+    Hash functions in _REDRAWN_PER_RUN are not hashed here but in every run.
+    Returns:
+        tuple: The hashed stream and the time it took in seconds.
+    """
+    if hash_func in _REDRAWN_PER_RUN:
+        return None, 0.0
+    start_time = time.perf_counter_ns()
+    hashed_stream = _hash_stream(algorithm, hash_func)
+    return hashed_stream, (time.perf_counter_ns() - start_time) * 1e-9
+
+def _run_configuration(algorithm, k, hash_func, hashed_stream, cardinality, runs, min_runs=32, eps=0.01):
+    """
+    Run one (k, hash function) configuration of the current test up to `runs` times.
+    After `min_runs` runs it stops as soon as the standard errors of the mean
+    time and of the mean error, tracked with Welford's algorithm, are both at
+    most `eps` times their mean. The error only varies between runs for the
+    hash functions drawn again in every run, for the others the time decides.
+    Returns:
+        tuple: The total error, time and estimated cardinality over the runs,
+            and the number of runs actually done.
+    """
+    total_error = 0.0
+    total_time = 0.0
+    total_estimated_cardinality = 0.0
+    # Running mean and sum of squared deviations of the time and the error
+    mean_time = m2_time = 0.0
+    mean_error = m2_error = 0.0
+    n = 0
+
+    # One estimator per configuration, cleared between runs
+    if algorithm == "REC":
+        recordinality = Recordinality(k=k, hashfunc=hash_func)
+    elif algorithm == "HLL":
+        hll = HyperLogLog(p=k, hashfunc=hash_func)
+
+    redraw = hash_func in _REDRAWN_PER_RUN
 
-def python_hash_int(element):
-    return hash(element) & 0xFFFFFFFF 
+    while n < runs:
+        start_time = time.perf_counter_ns()
 
-def sha256_hash(element):
-    return int(hashlib.sha256(str(element).encode()).hexdigest(), 16) / (2**256 - 1)
+        if redraw:
+            # A new hash function for this run, so its hashing is part of the run
+            _draw_random_hash_family(n)
+            hashed_stream = _hash_stream(algorithm, hash_func)
 
-def xxhash32(element):
-    return xxhash.xxh32(str(element).encode()).intdigest() / (2**32 - 1)
+        if algorithm == "REC":
+            estimated_cardinality = recordinality.estimate_from_hashes(hashed_stream, distinct=True)
+        elif algorithm == "HLL":
+            hll.clear()
+            hll.add_batch(_distinct_stream, precomputed_hashes=hashed_stream)
+            estimated_cardinality = hll.count()
 
-def python_hash(element):
-    return (hash(element) & 0xFFFFFFFF) / (2**32 - 1)
+        elapsed_time = (time.perf_counter_ns() - start_time) * 1e-9
+        error = abs(estimated_cardinality - cardinality) / cardinality
 
-def test_recordinality(k_values, hash_functions, algorithm, data_stream, cardinality, runs=1000, output_file="results.csv", source="unknown"):
+        total_time += elapsed_time
+        total_error += error
+        total_estimated_cardinality += estimated_cardinality
+
+        n += 1
+        delta = elapsed_time - mean_time
+        mean_time += delta / n
+        m2_time += delta * (elapsed_time - mean_time)
+        delta = error - mean_error
+        mean_error += delta / n
+        m2_error += delta * (error - mean_error)
+        if (
+            n >= min_runs
+            and math.sqrt(m2_time / (n * (n - 1))) <= eps * mean_time
+            and math.sqrt(m2_error / (n * (n - 1))) <= eps * mean_error
+        ):
+            break
+
+    return total_error, total_time, total_estimated_cardinality, n
+
+def test_recordinality(k_values, hash_functions, algorithm, data_stream, cardinality, runs=1000, source="unknown", encoded_stream=None, max_workers=1):
     """
-    Test different configurations of Recordinality or HLL multiple times and save results to CSV.
+    Test different configurations of Recordinality or HLL multiple times.
     Args:
         k_values (list): List of subset sizes (for REC) or precision values (for HLL).
         hash_functions (dict): Dictionary of hash function names and callables.
         algorithm (string): The name of the algorithm to test ("HLL" or "REC").
         data_stream (list): The list of data to evaluate.
         cardinality (int): Number of distinct elements in the stream.
-        runs (int): Number of runs to average results.
-        output_file (str): Path to the CSV file for storing results.
+        runs (int): Maximum number of runs to average results, fewer are done
+            once the average time and error have converged (see _run_configuration).
         source (str): The source of the data ("book name" or "generator").
+        encoded_stream (list): data_stream already passed through encode_stream(),
+            to share the encoding between several tests of the same data.
+        max_workers (int): Number of processes the configurations are spread over,
+            os.cpu_count() with None. With 1, the default, everything runs in this
+            process. Worker processes need picklable hash functions, so with
+            lambdas or closures everything runs in this process as well.
+            In the processes, average_time is measured while other configurations
+            run on the same cores, which also adds to its variance between runs.
+    Returns:
+        list: One result row per configuration, to be saved with write_results().
     """
     results = []
     print(f"\nTesting {algorithm} configurations with average error over multiple runs...\n")
 
-    for k in k_values:
-        for hash_name, hash_func in hash_functions.items():
-            total_error = 0.0
-            total_time = 0.0
-            total_estimated_cardinality = 0.0
-
-            for _ in range(runs):
-                start_time = time.time()
-
-                if algorithm == "REC":
-                    recordinality = Recordinality(k=k, hashfunc=hash_func)
-                    recordinality.run_rec(data_stream)
-                    estimated_cardinality = recordinality.estimate_cardinality()
-                elif algorithm == "HLL":
-                    hll = HyperLogLog(p=k, hashfunc=hash_func)
-                    hll.add_elements_to_hll(data_stream)
-                    estimated_cardinality = hll.count()
-
-                elapsed_time = time.time() - start_time
-                error = abs(estimated_cardinality - cardinality) / cardinality
-
-                total_time += elapsed_time
-                total_error += error
-                total_estimated_cardinality += estimated_cardinality
-
-            memory = k
-            if algorithm == "HLL":
-                memory = 2**k
-            average_error = total_error / runs
-            average_time = total_time / runs
-            average_estimated_cardinality = total_estimated_cardinality / runs
+    # Duplicates never change an estimate: HyperLogLog registers ignore them
+    # and a repeated element can never be a new record for Recordinality, so
+    # only the distinct elements are hashed. dict.fromkeys keeps the order of
+    # first occurrences, which is what Recordinality depends on. HyperLogLog
+    # hashes integer arrays from their raw bytes, anything else is encoded here.
+    # This pass is shared by every configuration and is not part of average_time.
+    if encoded_stream is not None:
+        distinct_stream = list(dict.fromkeys(encoded_stream))
+    elif algorithm == "HLL" and isinstance(data_stream, np.ndarray):
+        distinct_stream = np.unique(data_stream)
+    else:
+        distinct_stream = list(dict.fromkeys(encode_stream(data_stream)))
+
+    # Every (k, hash function) configuration is independent. The workers get
+    # the distinct stream once through the initializer, not with every task.
+    if max_workers == 1 or not _picklable(hash_functions):
+        _init_worker(distinct_stream)
+        executor = contextlib.nullcontext()
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker, initargs=(distinct_stream,)
+        )
+    with executor as pool:
+        pool_map = map if pool is None else pool.map
+        hash_names = list(hash_functions)
+        hash_funcs = list(hash_functions.values())
+
+        # The hashed stream only depends on the hash function, so it is computed
+        # once and replayed for every k and every run. The cost of hashing the
+        # distinct elements is still added to each run, so average_time compares
+        # the hash functions as well as the estimators.
+        # RandomHashFamily is drawn again in every run and hashes in the run itself.
+        hashed = dict(zip(hash_names, pool_map(_hash_distinct, [algorithm] * len(hash_funcs), hash_funcs)))
+
+        grid = list(itertools.product(hash_names, k_values))
+        totals = pool_map(
+            _run_configuration,
+            [algorithm] * len(grid),
+            [k for _, k in grid],
+            [hash_functions[hash_name] for hash_name, _ in grid],
+            [hashed[hash_name][0] for hash_name, _ in grid],
+            [cardinality] * len(grid),
+            [runs] * len(grid),
+        )
+
+        # HLL uses 2**p registers, REC keeps k elements
+        memory_of = {k: (1 << k if algorithm == "HLL" else k) for k in k_values}
+
+        for (hash_name, k), (total_error, total_time, total_estimated_cardinality, n) in zip(grid, totals):
+            hash_time = hashed[hash_name][1]
+
+            memory = memory_of[k]
+            average_error = total_error / n
+            average_time = total_time / n + hash_time
+            average_estimated_cardinality = total_estimated_cardinality / n
 
             results.append({
                 "source": source,  # Ajout de la colonne source
@@ -121,15 +322,23 @@ def test_recordinality(k_values, hash_functions, algorithm, data_stream, cardina
                 "hash_function": hash_name,
                 "average_error": average_error,
                 "average_estimated_cardinality": average_estimated_cardinality,
-                "nb_of_run": runs
+                "nb_of_run": n
             })
 
             print(f"Source={source}, k={k}, Hash={hash_name}, Avg. Error={average_error:.6f}, Avg. Time={average_time:.6f}s")
 
-    # Append results to CSV
+    return results
+
+def write_results(results, output_file):
+    """
+    Append result rows to a CSV file, opening it once for all of them.
+    Args:
+        results (list): Result rows returned by test_recordinality.
+        output_file (str): Path to the CSV file, its header is written if it does not exist yet.
+    """
     file_exists = os.path.isfile(output_file)
 
-    with open(output_file, mode="a", newline="") as file:
+    with open(output_file, mode="a", newline="", buffering=1 << 20) as file:
         writer = csv.DictWriter(file, fieldnames=[
             "source", "memory", "cardinality", "total_elements", "average_time",
             "algorithm", "hash_function", "average_error", "average_estimated_cardinality", "nb_of_run"
@@ -140,7 +349,59 @@ def test_recordinality(k_values, hash_functions, algorithm, data_stream, cardina
 
     print(f"\nResults saved to {output_file}")
   
-def test_books_in_directory(directory, k_values, p_values, hash_functions, hash_functions_hll, runs=10):
+def _process_book(book_name, paths, k_values, p_values, hash_functions, hash_functions_hll, runs):
+    """
+    Run the REC and HLL tests of one book.
+    Returns:
+        tuple: The REC and HLL result rows of the book.
+    """
+    print(f"\nProcessing Book: {book_name}\n")
+    txt_path = paths["txt"]
+    dat_path = paths["dat"]
+    rec_results = []
+    hll_results = []
+
+    # Load the text and the cardinality info. The words are read as bytes,
+    # already encoded for the hash functions and shared by every test.
+    list_from_text = read_txt_as_bytes_list(txt_path)
+    true_cardinality, frequency_dict = get_cardinality_and_dict_from_dat(dat_path)
+
+    # The books are already spread over the processes, so every test of a
+    # book runs in the process of that book.
+    # REC
+    #rec_results += test_recordinality(
+    #    k_values, 
+    #    hash_functions, 
+    #    "REC", 
+    #    list_from_text, 
+    #    true_cardinality, 
+    #    runs=runs, 
+    #    source=book_name,
+    #    encoded_stream=list_from_text,
+    #    max_workers=1
+    #)
+
+    # HLL
+    hll_results += test_recordinality(
+        p_values, 
+        hash_functions_hll, 
+        "HLL", 
+        list_from_text, 
+        true_cardinality, 
+        runs=runs, 
+        source=book_name,
+        encoded_stream=list_from_text,
+        max_workers=1
+    )
+    return rec_results, hll_results
+
+def _run_now(fn, *args):
+    # Same interface as Executor.submit, for the books processed in this process
+    future = Future()
+    future.set_result(fn(*args))
+    return future
+
+def test_books_in_directory(directory, k_values, p_values, hash_functions, hash_functions_hll, runs=10, max_workers=None):
     """
     Process all book pairs in a directory and run REC and HLL tests.
     Args:
@@ -150,42 +411,38 @@ def test_books_in_directory(directory, k_values, p_values, hash_functions, hash_
         hash_functions (dict): Hash functions for REC.
         hash_functions_hll (dict): Hash functions for HLL.
         runs (int): Number of runs for each configuration.
+        max_workers (int): Number of processes the books are spread over,
+            os.cpu_count() by default. With 1, or with hash functions that cannot
+            be pickled such as lambdas, the books are processed in this process.
+            Books processed at the same time share the cores, so their
+            average_time includes that contention.
     """
     book_pairs = get_book_pairs(directory)
     print(f"Found {len(book_pairs)} books in directory: {directory}")
+    # Rows of every book, written once at the end
+    rec_results = []
+    hll_results = []
 
-    for book_name, paths in book_pairs.items():
-        print(f"\nProcessing Book: {book_name}\n")
-        txt_path = paths["txt"]
-        dat_path = paths["dat"]
-
-        # Load the text and the cardinality info
-        list_from_text = read_txt_as_list(txt_path)
-        true_cardinality, frequency_dict = get_cardinality_and_dict_from_dat(dat_path)
-
-        # REC
-        #test_recordinality(
-        #    k_values, 
-        #    hash_functions, 
-        #    "REC", 
-        #    list_from_text, 
-        #    true_cardinality, 
-        #    runs=runs, 
-        #    output_file="results_rec_book.csv", 
-        #    source=book_name
-        #)
-
-        # HLL
-        test_recordinality(
-            p_values, 
-            hash_functions_hll, 
-            "HLL", 
-            list_from_text, 
-            true_cardinality, 
-            runs=runs, 
-            output_file="results_hll_book.csv", 
-            source=book_name
-        )
+    # Books share nothing, each one is parsed and tested in its own process
+    if max_workers == 1 or not _picklable(hash_functions, hash_functions_hll):
+        _warm_up()
+        executor = contextlib.nullcontext()
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_warm_up)
+    with executor as pool:
+        submit = _run_now if pool is None else pool.submit
+        futures = [
+            submit(_process_book, book_name, paths, k_values, p_values, hash_functions, hash_functions_hll, runs)
+            for book_name, paths in book_pairs.items()
+        ]
+        # Collected in submission order so the CSV keeps the order of the books
+        for future in futures:
+            book_rec_results, book_hll_results = future.result()
+            rec_results += book_rec_results
+            hll_results += book_hll_results
+
+    #write_results(rec_results, "results_rec_book.csv")
+    write_results(hll_results, "results_hll_book.csv")
   
 if __name__ == "__main__":
     # Batch Run for REC
@@ -196,22 +453,28 @@ if __name__ == "__main__":
     p_values = [5, 7, 10, 11]
     # Config for REC
     hash_functions = {
+        "xxh3_64": xxh3_64,
         "SHA-256": sha256_hash,
         "xxHash32": xxhash32,
         "Python Hash": python_hash,
+        "RandomHashFamily": random_hash,
     }
     
     # Config for HLL
     hash_functions_hll = {
+        "xxh3_64": xxh3_64_int,
         "SHA-256": sha256_hash_int,
         "xxHash32": xxhash32_int,
         "Python Hash": python_hash_int,
-        "RandomHashFamily": None
+        "RandomHashFamily": random_hash_int
     }
     
     test_books_in_directory(book_directory, k_values, p_values, hash_functions, hash_functions_hll, runs=10)
 
     
+    # Rows of every configuration, written once at the end
+    rec_generator_results = []
+    hll_generator_results = []
     for config in configurations:
         N = config["N"]
         n = config["n"]
@@ -220,23 +483,24 @@ if __name__ == "__main__":
         # Generator
         data_generator_stream, data_generator_cardinality, data_generator_frequency_dict = generate_list(N, n, "zipf", alpha)
         #REC
-        #test_recordinality(k_values, 
+        #rec_generator_results += test_recordinality(k_values, 
         #                  hash_functions, 
         #                  "REC", 
         #                  data_generator_stream, 
         #                  data_generator_cardinality,
         #                  runs=1, 
-        #                  output_file="results_rec_generator.csv", 
         #                  source="generator"
         #                   )
         #HLL
-        test_recordinality(p_values, 
+        hll_generator_results += test_recordinality(p_values, 
                           hash_functions_hll, 
                           "HLL", 
                           data_generator_stream, 
                           data_generator_cardinality, 
                           runs=1, 
-                          output_file="results_hll_generator.csv", 
                           source="generator"
                           )
 
+    #write_results(rec_generator_results, "results_rec_generator.csv")
+    write_results(hll_generator_results, "results_hll_generator.csv")
+